@@ -452,12 +452,22 @@ class ccxtCrypto:
             # market orders.
             order['Details']=self.GetOrderDetails(id=order['id'],symbol=pair)
             if Quiet!=True:
-                self.Log.Write("|- Order Confirmation ID: "+order['id'])
+                self.Log.Confirmation(order['id'],**self.FillDetails(order['Details']))
 
             return order
 
         return None
 
+    # What the exchange says was filled, for the result envelope
+
+    def FillDetails(self,details):
+        fill={}
+        if type(details) is dict:
+            for k in [ 'price','average','amount','filled','cost','status' ]:
+                if details.get(k)!=None:
+                    fill[k.capitalize()]=details[k]
+        return fill
+
     # Find the minimum amount/price. This is one of the mot complex areas of
     # cryptocurrency markets. Each exchange and market can has its own minimum
     # amout (units/shares) and price decided either of the base (left) or quote
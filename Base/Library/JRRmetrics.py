@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Jackrabbit Relay metrics
+# 2021 Copyright © Robert APM Darin
+# All rights reserved unconditionally.
+
+# Counters, gauges and histograms for the Relay server, given out in the
+# Prometheus text format on GET /metrics.
+#
+# The asyncio ingress is a single process and simply counts. The fork ingress
+# handles every request in its own short lived child, so anything the child
+# counts would die with it. There, the children send each event to the parent
+# over a datagram socket pair, and the parent adds them up between requests.
+# Every child forked afterwards, including the one answering /metrics, starts
+# with the parent's totals.
+
+# Event, one datagram each:
+# [ "c", "requests_total", [ [ "method","POST" ] ], 1 ]
+# [ "h", "order_seconds", [ [ "exchange","kucoin" ],[ "market","spot" ] ], 0.734 ]
+# [ "g", "inflight_requests", [], 12 ]
+
+import sys
+sys.path.append('/home/JackrabbitRelay2/Base/Library')
+import os
+import socket
+import threading
+import json
+
+# Latency buckets, in seconds
+
+LatencyBuckets=[ 0.05,0.1,0.25,0.5,1,2.5,5,10,30,60 ]
+SpawnBuckets=[ 0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5 ]
+
+# Label values are quoted, so only these need escaping
+
+def LabelValue(v):
+    return str(v).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+def LabelText(labels,extra=None):
+    l=list(labels)
+    if extra!=None:
+        l.append(extra)
+    if len(l)==0:
+        return ''
+    return '{'+','.join(f'{k}="{LabelValue(v)}"' for k,v in l)+'}'
+
+def Number(v):
+    if type(v) is float and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+class RelayMetrics:
+    def __init__(self,Prefix='jackrabbit_relay'):
+        self.Prefix=Prefix
+        self.lock=threading.Lock()
+        self.Order=[]
+        self.Help={}
+        self.Types={}
+        self.Buckets={}
+        self.Series={}
+
+        self.owner=os.getpid()
+        self.reader=None
+        self.writer=None
+
+    # Declare a series before it is used. A counter without labels is shown as
+    # 0 until it is counted.
+
+    def Counter(self,name,help,Labels=True):
+        self.Order.append(name)
+        self.Help[name]=help
+        self.Types[name]='counter'
+        self.Series[name]={}
+        if not Labels:
+            self.Series[name][()]=0
+
+    def Gauge(self,name,help,Labels=True):
+        self.Order.append(name)
+        self.Help[name]=help
+        self.Types[name]='gauge'
+        self.Series[name]={}
+        if not Labels:
+            self.Series[name][()]=0
+
+    def Histogram(self,name,help,buckets):
+        self.Order.append(name)
+        self.Help[name]=help
+        self.Types[name]='histogram'
+        self.Buckets[name]=buckets
+        self.Series[name]={}
+
+    # The channel the fork ingress children report through. Opened by the
+    # parent before it forks anything.
+    #
+    # With several listener processes, the supervisor opens a named channel
+    # instead and every listener connects to it, so all counts end up in one
+    # place.
+
+    def OpenChannel(self,Path=None):
+        if Path==None:
+            self.reader,self.writer=socket.socketpair(socket.AF_UNIX,socket.SOCK_DGRAM)
+            self.writer.settimeout(0.1)
+        else:
+            try:
+                os.unlink(Path)
+            except:
+                pass
+            self.reader=socket.socket(socket.AF_UNIX,socket.SOCK_DGRAM)
+            self.reader.bind(Path)
+            os.chmod(Path,0o600)
+        self.reader.setblocking(False)
+        self.owner=os.getpid()
+
+    def Connect(self,Path):
+        try:
+            writer=socket.socket(socket.AF_UNIX,socket.SOCK_DGRAM)
+            writer.connect(Path)
+            writer.settimeout(0.1)
+        except:
+            return False
+        # Nothing is ever counted here, it all goes to the supervisor
+        self.writer=writer
+        self.owner=None
+        return True
+
+    def Inc(self,name,labels=None,value=1):
+        self.Record([ 'c',name,self.Labels(labels),value ])
+
+    def Set(self,name,value,labels=None):
+        self.Record([ 'g',name,self.Labels(labels),value ])
+
+    def Observe(self,name,value,labels=None):
+        self.Record([ 'h',name,self.Labels(labels),value ])
+
+    def Labels(self,labels):
+        if labels==None:
+            return []
+        return [ [ k,str(labels[k]) ] for k in labels ]
+
+    # A child waits at most a tenth of a second on the parent. The kernel only
+    # queues a few datagrams on a named socket. If the parent has fallen that
+    # far behind, the event is dropped.
+
+    def Record(self,event):
+        if self.writer!=None and os.getpid()!=self.owner:
+            try:
+                self.writer.send(json.dumps(event).encode())
+            except:
+                pass
+            return
+        self.Apply(event)
+
+    def Apply(self,event):
+        try:
+            kind,name,labels,value=event
+            key=tuple((k,v) for k,v in labels)
+        except:
+            return
+        if name not in self.Series:
+            return
+
+        with self.lock:
+            series=self.Series[name]
+            if kind=='c':
+                series[key]=series.get(key,0)+value
+            elif kind=='g':
+                series[key]=value
+            elif kind=='h':
+                buckets=self.Buckets[name]
+                if key not in series:
+                    # One count per bucket, then +Inf, sum
+                    series[key]=[ 0 ]*(len(buckets)+2)
+                h=series[key]
+                for i in range(len(buckets)):
+                    if value<=buckets[i]:
+                        h[i]+=1
+                        break
+                else:
+                    h[len(buckets)]+=1
+                h[-1]+=value
+
+    # Add up everything the children have sent. Parent only.
+
+    def Drain(self):
+        if self.reader==None or os.getpid()!=self.owner:
+            return
+        while True:
+            try:
+                buf=self.reader.recv(65536)
+            except:
+                break
+            try:
+                self.Apply(json.loads(buf))
+            except:
+                pass
+
+    # Prometheus text exposition format
+
+    def Render(self):
+        out=[]
+        with self.lock:
+            for name in self.Order:
+                full=self.Prefix+'_'+name
+                out.append(f'# HELP {full} {self.Help[name]}')
+                out.append(f'# TYPE {full} {self.Types[name]}')
+                series=self.Series[name]
+                for key in sorted(series):
+                    if self.Types[name]!='histogram':
+                        out.append(f'{full}{LabelText(key)} {Number(series[key])}')
+                        continue
+
+                    h=series[key]
+                    buckets=self.Buckets[name]
+                    total=0
+                    for i in range(len(buckets)):
+                        total+=h[i]
+                        out.append(f'{full}_bucket{LabelText(key,("le",Number(buckets[i])))} {total}')
+                    total+=h[len(buckets)]
+                    out.append(f'{full}_bucket{LabelText(key,("le","+Inf"))} {total}')
+                    out.append(f'{full}_sum{LabelText(key)} {h[-1]}')
+                    out.append(f'{full}_count{LabelText(key)} {total}')
+        return '\n'.join(out)+'\n'
+
+###
+### End of module
+###
@@ -476,7 +476,7 @@ class mimic:
             # market orders.
             order['Details']=self.GetOrderDetails(id=result['ID'],symbol=pair)
             if Quiet!=True:
-                self.Log.Write("|- Order Confirmation ID: "+result['ID'])
+                self.Log.Confirmation(result['ID'],Price=result.get('Price'),Amount=result.get('Amount'))
 
             #JRRledger.WriteLedger(pair, m, action, amount, price, order, ln)
             return order
@@ -303,6 +303,20 @@ class oanda:
     # PlaceOrder(pair=pair, orderType=orderType, action=action, amount=amount, 
     #   close=close, Ticket=45, ReduceOnly=ReduceOnly, LedgerNote=ledgerNote)
 
+    # What the order create response says was filled, for the result
+    # envelope. Comes with the response, nothing is asked of the broker.
+
+    def FillDetails(self):
+        fill={}
+        try:
+            ft=self.Results['orderFillTransaction']
+            for k in [ 'price','units','pl','financing','commission' ]:
+                if k in ft:
+                    fill[k.capitalize()]=ft[k]
+        except:
+            pass
+        return fill
+
     # IMPORTANT: buy and sell are TWO DIFFERENT END POINTS
 
     # Market orders are fill or kill (FOK) for timeInForce by default. GTC will
@@ -350,21 +364,21 @@ class oanda:
                         self.Log.Error("|- Order failed with: CANCELLED "+self.Results['orderCancelTransaction']['reason'])
                 else:
                     if Quiet!=True:
-                        self.Log.Write("|- Order Confirmation ID: "+self.Results['orderCreateTransaction']['id'])
+                        self.Log.Confirmation(self.Results['orderCreateTransaction']['id'],**self.FillDetails())
             elif 'longOrderCreateTransaction' in self.Results:
                 if 'orderCancelTransaction' in self.Results:
                     if Quiet!=True:
                         self.Log.Error("|- Order failed with: CANCELLED "+self.Results['orderCancelTransaction']['reason'])
                 else:
                     if Quiet!=True:
-                        self.Log.Write("|- Order Confirmation ID: "+self.Results['longOrderCreateTransaction']['id'])
+                        self.Log.Confirmation(self.Results['longOrderCreateTransaction']['id'],**self.FillDetails())
             elif 'shortOrderCreateTransaction' in self.Results:
                 if 'orderCancelTransaction' in self.Results:
                     if Quiet!=True:
                         self.Log.Error("|- Order failed with: CANCELLED "+self.Results['orderCancelTransaction']['reason'])
                 else:
                     if Quiet!=True:
-                        self.Log.Write("|- Order Confirmation ID: "+self.Results['shortOrderCreateTransaction']['id'])
+                        self.Log.Confirmation(self.Results['shortOrderCreateTransaction']['id'],**self.FillDetails())
         elif (action=='sell'):
             params={}
             if ticket==None:
@@ -389,21 +403,21 @@ class oanda:
                             self.Log.Error("|- Order failed with: CANCELLED "+self.Results['orderCancelTransaction']['reason'])
                     else:
                         if Quiet!=True:
-                            self.Log.Write("|- Order Confirmation ID: "+self.Results['orderCreateTransaction']['id'])
+                            self.Log.Confirmation(self.Results['orderCreateTransaction']['id'],**self.FillDetails())
                 elif 'longOrderCreateTransaction' in self.Results:
                     if 'orderCancelTransaction' in self.Results:
                         if Quiet!=True:
                             self.Log.Error("|- Order failed with: CANCELLED "+self.Results['orderCancelTransaction']['reason'])
                     else:
                         if Quiet!=True:
-                            self.Log.Write("|- Order Confirmation ID: "+self.Results['longOrderCreateTransaction']['id'])
+                            self.Log.Confirmation(self.Results['longOrderCreateTransaction']['id'],**self.FillDetails())
                 elif 'shortOrderCreateTransaction' in self.Results:
                     if 'orderCancelTransaction' in self.Results:
                         if Quiet!=True:
                             self.Log.Error("|- Order failed with: CANCELLED "+self.Results['orderCancelTransaction']['reason'])
                     else:
                         if Quiet!=True:
-                            self.Log.Write("|- Order Confirmation ID: "+self.Results['shortOrderCreateTransaction']['id'])
+                            self.Log.Confirmation(self.Results['shortOrderCreateTransaction']['id'],**self.FillDetails())
             else:
                 if 'ALL' not in str(amount).upper():
                     # amount is STR, need float for abs()
@@ -424,21 +438,21 @@ class oanda:
                             self.Log.Error("|- Order failed with: CANCELLED "+self.Results['orderCancelTransaction']['reason'])
                     else:
                         if Quiet!=True:
-                            self.Log.Write("|- Order Confirmation ID: "+self.Results['orderCreateTransaction']['id'])
+                            self.Log.Confirmation(self.Results['orderCreateTransaction']['id'],**self.FillDetails())
                 elif 'longOrderCreateTransaction' in self.Results:
                     if 'orderCancelTransaction' in self.Results:
                         if Quiet!=True:
                             self.Log.Error("|- Order failed with: CANCELLED "+self.Results['orderCancelTransaction']['reason'])
                     else:
                         if Quiet!=True:
-                            self.Log.Write("|- Order Confirmation ID: "+self.Results['longOrderCreateTransaction']['id'])
+                            self.Log.Confirmation(self.Results['longOrderCreateTransaction']['id'],**self.FillDetails())
                 elif 'shortOrderCreateTransaction' in self.Results:
                     if 'orderCancelTransaction' in self.Results:
                         if Quiet!=True:
                             self.Log.Error("|- Order failed with: CANCELLED "+self.Results['orderCancelTransaction']['reason'])
                     else:
                         if Quiet!=True:
-                            self.Log.Write("|- Order Confirmation ID: "+self.Results['shortOrderCreateTransaction']['id'])
+                            self.Log.Confirmation(self.Results['shortOrderCreateTransaction']['id'],**self.FillDetails())
         else:
             self.Log.Error("PlaceOrder","Action is neither BUY nor SELL")
 
@@ -15,6 +15,11 @@ import time
 import random
 import socket
 import json
+import atexit
+import threading
+import gzip
+import shutil
+import requests
 
 # Get the starting nice value to measure and control OS load.
 
@@ -99,6 +104,7 @@ class SignalInterceptor():
             self.ShowSignalMessage(f'Exiting child: {mypid}')
         else:
             self.ShowSignalMessage(f'Exiting self: {mypid}')
+        FlushLogs()
         os.kill(mypid,9)
 
     # Signal handler for child process exit
@@ -226,6 +232,118 @@ class SignalInterceptor():
 
 # { "ID":"DEADBWEEF", "FileName":"testData", "Action":"Lock", "Expire":"300" }
 
+# The connection to the Locker server. Every Locker of a process shares one,
+# held open for as long as the process lives, and any number of commands can
+# be sent on it before reading the answers, which come back in the same order.
+# A forked child opens its own.
+#
+# If the connection is gone, like after the server restarted, it is opened
+# again and the commands sent once more. Every command is safe to repeat for
+# the same owner ID.
+
+class LockerConnection:
+    def __init__(self,host,port,path=None):
+        self.host=host
+        self.port=port
+        self.path=path
+        self.sock=None
+        self.rfile=None
+        self.pid=None
+        self.lock=threading.Lock()
+
+    # The unix socket if the server has one, TCP otherwise
+
+    def Connect(self):
+        self.Close()
+        self.sock=None
+        if self.path!=None and os.path.exists(self.path):
+            try:
+                self.sock=socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.connect(self.path)
+            except:
+                self.sock.close()
+                self.sock=None
+        if self.sock==None:
+            self.sock=socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+            self.sock.connect((self.host, self.port))
+        self.rfile=self.sock.makefile('rb')
+        self.pid=os.getpid()
+
+    def Close(self):
+        try:
+            if self.pid==os.getpid():
+                self.rfile.close()
+                self.sock.close()
+        except:
+            pass
+        self.sock=None
+        self.rfile=None
+        self.pid=None
+
+    # Send the commands, one per line, and return the answers, or None if the
+    # server can't be reached. With a Timeout, None if the answers take longer
+    # than that. The connection is dropped then, as the answers may still come.
+
+    def Pipeline(self,msgs,Timeout=None):
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.sock==None or self.pid!=os.getpid():
+                        self.Connect()
+                    self.sock.settimeout(Timeout)
+                    self.sock.sendall(''.join(msgs).encode())
+                    res=[]
+                    for msg in msgs:
+                        buf=self.rfile.readline()
+                        if not buf:
+                            raise ConnectionError('Locker connection closed')
+                        res.append(buf.decode())
+                    return res
+                except socket.timeout:
+                    self.Close()
+                    return None
+                except:
+                    self.Close()
+            return None
+
+LockerConnections={}
+LockerConnectionsLock=threading.Lock()
+
+# Same host clients talk to the Locker over a unix socket when its settings
+# turn one on, and skip the TCP stack altogether.
+
+LockerSettingsFile='/home/JackrabbitRelay2/Config/JackrabbitLocker.cfg'
+
+def LockerSocketName(port):
+    return f"/home/JackrabbitRelay2/Base/Locker.{port}.sock"
+
+def GetLockerConnection(host,port):
+    with LockerConnectionsLock:
+        if (host,port) not in LockerConnections:
+            path=None
+            if host in [ '','localhost','127.0.0.1' ] \
+            and ReadSettings(LockerSettingsFile,{ "UnixSocket":False })['UnixSocket']:
+                path=LockerSocketName(port)
+            LockerConnections[(host,port)]=LockerConnection(host,port,path)
+        return LockerConnections[(host,port)]
+
+# A lock wait holds its connection until the lock is handed over. Each thread
+# waits on a connection of its own, so it never stands in the way of another
+# thread unlocking. Servers that don't know LockWait are remembered in
+# LockWaits and polled instead.
+
+LockerWaitConnections=threading.local()
+LockWaits={}
+
+def GetLockerWaitConnection(host,port):
+    conns=getattr(LockerWaitConnections,'conns',None)
+    if conns==None:
+        conns=LockerWaitConnections.conns={}
+    if (host,port) not in conns:
+        conns[(host,port)]=LockerConnection(host,port,GetLockerConnection(host,port).path)
+    return conns[(host,port)]
+
 class Locker:
     # Initialize the file name
     def __init__(self,filename,Retry=7,Timeout=300,Log=None,ID=None):
@@ -262,29 +380,47 @@ class Locker:
             pw+=oc
         return pw
 
-    # Contact the Locker Server and WAIT for response. NOT thread safe.
+    # Contact the Locker Server and WAIT for response
 
     def Talker(self,msg,casefold=True):
-        try:
-            ls=socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            ls.connect((self.host, self.port))
-            sfn=ls.makefile('rw')
-            sfn.write(msg)
-            sfn.flush()
-            buf=None
-            while buf==None:
-                buf=sfn.readline()
-            ls.close()
-            if len(buf)!=0:
-                if casefold==True:
-                    return buf.lower().strip()
-                else:
-                    return buf.strip()
+        res=GetLockerConnection(self.host,self.port).Pipeline([ msg ])
+        if res==None:
+            return None
+        buf=res[0]
+        if len(buf)!=0:
+            if casefold==True:
+                return buf.lower().strip()
             else:
-                return None
-        except:
+                return buf.strip()
+        else:
             return None
 
+    # Send several requests at once and wait for all of the answers. Each
+    # request is a dictionary with Action and, as needed, Expire and
+    # DataStore. The answers are the server's replies, in order. None if the
+    # server can't be reached.
+    #
+    #    lock.Pipeline([ { "Action":"Get" }, { "Action":"Put", "Expire":300, "DataStore":"Running" } ])
+
+    def Pipeline(self,reqs):
+        msgs=[]
+        for req in reqs:
+            msg={ "ID":self.ID, "FileName":self.filename, "Action":req['Action'], "Expire":str(req.get('Expire',0)) }
+            if 'DataStore' in req:
+                msg['DataStore']=req['DataStore']
+            msgs.append(json.dumps(msg)+'\n')
+
+        res=GetLockerConnection(self.host,self.port).Pipeline(msgs)
+        if res==None:
+            return None
+        results=[]
+        for buf in res:
+            try:
+                results.append(json.loads(buf))
+            except:
+                results.append(None)
+        return results
+
     # Contact Lock server
 
     def Retry(self,action,expire,casefold=True):
@@ -345,6 +481,96 @@ class Locker:
                     time.sleep(0.1)
         return buf
 
+    # Wait on the server for the lock until the deadline. The server hands it
+    # over the moment it is unlocked or expires. None if the server can't be
+    # reached or doesn't wait.
+
+    def Wait(self,expire,deadline):
+        if not LockWaits.get((self.host,self.port),True):
+            return None
+
+        timeout=max(0.001,deadline-time.time())
+        msg={ "ID":self.ID, "FileName":self.filename, "Action":"LockWait", "Expire":str(expire), "Timeout":str(timeout) }
+        # The server gives the answer, this is only in case it never does
+        res=GetLockerWaitConnection(self.host,self.port).Pipeline([ json.dumps(msg)+'\n' ],Timeout=timeout+5)
+        if res==None:
+            return None
+        try:
+            resp=json.loads(res[0])['Status'].lower()
+        except:
+            return None
+        if resp=='badaction':
+            LockWaits[(self.host,self.port)]=False
+            return None
+        return resp
+
+    # Several requests, for this or any other Locker, carried out by the server
+    # in one go. Request gives the step for each of them. The answers are the
+    # server's replies, in order. The server stops at the first that fails and
+    # answers the rest "Skipped", but still carries out any Unlock. A LockWait
+    # may only come first, and makes the whole batch wait for the lock. None if
+    # the server can't be reached or doesn't know Batch.
+    #
+    #    otLock.Batch([ otLock.Request("LockWait",300), memory.Request("Get"), otLock.Request("Unlock") ])
+
+    def Request(self,action,expire=0,data=None):
+        step={ "ID":self.ID, "FileName":self.filename, "Action":action, "Expire":str(expire) }
+        if data!=None:
+            step['DataStore']=data
+        if action.lower()=='lockwait':
+            step['Timeout']=str(self.timeout)
+        return step
+
+    def Batch(self,steps):
+        msg={ "ID":self.ID, "FileName":self.filename, "Action":"Batch", "Expire":"0", "Actions":steps }
+        if len(steps)>0 and steps[0]['Action'].lower()=='lockwait':
+            conn=GetLockerWaitConnection(self.host,self.port)
+            timeout=float(steps[0]['Timeout'])+5
+        else:
+            conn=GetLockerConnection(self.host,self.port)
+            timeout=None
+        res=conn.Pipeline([ json.dumps(msg)+'\n' ],Timeout=timeout)
+        if res==None:
+            return None
+        try:
+            return json.loads(res[0])['Results']
+        except:
+            return None
+
+    # Take tokens from whichever of several buckets is least used. Each bucket
+    # is a dictionary of its Key (name), Interval and Burst. ( 0, key ) with
+    # the bucket they were taken from, or ( seconds to wait, None ). None if
+    # the server can't be reached or doesn't know AcquireAny.
+
+    def AcquireAny(self,buckets,tokens=1):
+        msg={ "ID":self.ID, "FileName":self.filename, "Action":"AcquireAny", "Expire":"0", \
+              "Tokens":str(tokens), "Keys":buckets }
+        res=GetLockerConnection(self.host,self.port).Pipeline([ json.dumps(msg)+'\n' ])
+        if res==None:
+            return None
+        try:
+            resp=json.loads(res[0])
+            if resp['Status']=='Granted':
+                return 0,resp['Key']
+            if resp['Status']=='Wait':
+                return float(resp['Wait']),None
+        except:
+            pass
+        return None
+
+    # Tokens given out, waits and tokens left for each bucket whose name
+    # starts with this one's
+
+    def Stats(self):
+        msg={ "ID":self.ID, "FileName":self.filename, "Action":"Stats", "Expire":"0" }
+        res=GetLockerConnection(self.host,self.port).Pipeline([ json.dumps(msg)+'\n' ])
+        if res==None:
+            return None
+        try:
+            return json.loads(res[0])['Stats']
+        except:
+            return None
+
     # Lock the file
 
     def Lock(self,expire=300):
@@ -352,7 +578,9 @@ class Locker:
         done=False
         timeout=time.time()+self.timeout
         while not done:
-            resp=self.Retry("Lock",expire,casefold=True)
+            resp=self.Wait(expire,timeout)
+            if resp==None:
+                resp=self.Retry("Lock",expire,casefold=True)
             if resp=="locked":
                 done=True
             else:
@@ -361,9 +589,9 @@ class Locker:
                         self.Log.Error("Locker",f"{self.filename}: lock request failed")
                     else:
                         print("Locker",f"{self.filename}/{os.getpid()}: lock request failed")
-                        sys.eit(1)
-            # Prevent race conditions
-            time.sleep(0.1)
+                        sys.exit(1)
+                # Prevent race conditions
+                time.sleep(0.1)
         return resp
 
     # Unlock the file
@@ -384,6 +612,53 @@ class Locker:
 ### General purpose functions
 ###
 
+# Priority lanes, most urgent first. OliverTwist's strikes of conditional
+# orders and anything that gets out of a position go ahead of orders that open
+# one. A signal storm of buys shouldn't hold up a stop being taken.
+
+Lanes=[ 'strike','exit','entry' ]
+
+def OrderLane(order):
+    if type(order) is not dict:
+        return 'entry'
+    if 'OliverTwist' in order:
+        return 'strike'
+    if str(order.get('Action','')).lower().strip() in [ 'close','flip','sell','short' ]:
+        return 'exit'
+    return 'entry'
+
+# The result envelope, the last line of a transactor's output. See
+# JackrabbitLog.EnableResult.
+
+ResultMarker='JRResult: '
+
+def ResultLine(result):
+    return ResultMarker+json.dumps(result,default=str)+'\n'
+
+# Webhooks. Everything a process sends goes through one pooled session, so a
+# program that sends order after order to the same Relay, like OliverTwist,
+# keeps its connection open instead of setting up a new one every time. A
+# forked child starts its own, a connection is never shared between processes.
+#
+# The Relay answers 200 as soon as it has the request, so a pooled connection
+# that fails before any answer at all was closed before the request got there.
+# That one is sent again on a fresh connection.
+
+WebhookSessions={}
+
+def WebhookSession():
+    pid=os.getpid()
+    if pid not in WebhookSessions:
+        WebhookSessions.clear()
+        WebhookSessions[pid]=requests.Session()
+    return WebhookSessions[pid]
+
+def PostWebhook(url,data,headers=None):
+    try:
+        return WebhookSession().post(url,headers=headers,data=data)
+    except requests.exceptions.ConnectionError:
+        return WebhookSession().post(url,headers=headers,data=data)
+
 # General file tools
 
 def ReadFile(fn):
@@ -409,6 +684,225 @@ def AppendFile(fn,data):
     cf.write(data)
     cf.close()
 
+# Read a server settings file. Same layout as the exchange configs, one JSON
+# object per line and # for comments. Later lines override earlier ones, so
+# settings can be grouped however makes sense. A missing file or damaged line
+# simply leaves the defaults in place.
+
+def ReadSettings(fn,Defaults=None):
+    if Defaults==None:
+        settings={}
+    else:
+        settings=Defaults.copy()
+
+    if os.path.exists(fn):
+        cf=open(fn,'rt')
+        for line in cf.readlines():
+            line=line.strip()
+            if len(line)>0 and line[0]!='#':
+                try:
+                    settings.update(json.loads(line))
+                except:
+                    pass
+        cf.close()
+    return settings
+
+# Buffered log writer. Opening, appending and closing the log for every single
+# line adds up to thousands of syscalls a minute on a busy Relay. Lines are
+# queued instead and a background thread writes them out in one go every
+# FlushInterval seconds, so a crash loses at most one interval. Everything
+# left is written at exit.
+#
+# log=GetLogWriter('/home/JackrabbitRelay2/Logs/JackrabbitRelay.log')
+# log.Write(f'{time} {addr:16} {msg}\n')
+#
+# Many processes append to the same logs, so the file is opened O_APPEND and
+# each batch is a single write. Only the process that created the writer
+# rotates the file, forked children follow it to the new file. Rotation is off
+# unless asked for with SetRotation.
+
+class LogWriter:
+    def __init__(self,filename,FlushInterval=1):
+        self.filename=filename
+        self.FlushInterval=FlushInterval
+        self.lock=threading.Lock()
+        self.fileLock=threading.Lock()
+        self.pending=[]
+        self.fd=None
+        self.owner=os.getpid()
+
+        self.MaxSize=0
+        self.Rotate=0
+        self.Keep=0
+        self.Compress=True
+        self.RotateAt=0
+
+    def SetFlushInterval(self,FlushInterval):
+        self.FlushInterval=FlushInterval
+
+    # MaxSize in bytes, Rotate in seconds, Keep is the number of old logs to
+    # hold on to. 0 turns each off.
+
+    def SetRotation(self,MaxSize=0,Rotate=0,Keep=0,Compress=True):
+        self.MaxSize=MaxSize
+        self.Rotate=Rotate
+        self.Keep=Keep
+        self.Compress=Compress
+        if self.Rotate>0:
+            self.RotateAt=time.time()+self.Rotate
+
+    def Write(self,text):
+        with self.lock:
+            self.pending.append(text)
+
+        if self.FlushInterval<=0:
+            self.Flush()
+        else:
+            StartLogFlusher()
+
+    # The locks are only waited on for so long. Flush is also called from the
+    # signal interceptor, which may have interrupted this very thread while it
+    # was holding one.
+
+    def Flush(self):
+        if not self.lock.acquire(timeout=1):
+            return
+        data=''.join(self.pending).encode()
+        self.pending=[]
+        self.lock.release()
+
+        # Forked children write to the log too, but only the process that
+        # created the writer rotates it, even when it has nothing to write.
+
+        owner=(self.owner==os.getpid())
+        if (len(data)==0 and not owner) or not self.fileLock.acquire(timeout=5):
+            return
+        try:
+            self.Open()
+            while len(data)>0:
+                n=os.write(self.fd,data)
+                data=data[n:]
+            if owner:
+                self.CheckRotation()
+        except:
+            pass
+        self.fileLock.release()
+
+    # Open the log, or open it again if someone else rotated it away
+
+    def Open(self):
+        if self.fd!=None:
+            try:
+                if os.stat(self.filename).st_ino==os.fstat(self.fd).st_ino:
+                    return
+            except:
+                pass
+            os.close(self.fd)
+        self.fd=os.open(self.filename,os.O_WRONLY|os.O_APPEND|os.O_CREAT,0o644)
+
+    def CheckRotation(self):
+        now=time.time()
+        if (self.MaxSize>0 and os.fstat(self.fd).st_size>=self.MaxSize) \
+        or (self.Rotate>0 and now>=self.RotateAt):
+            old=self.filename+'.'+datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+            os.rename(self.filename,old)
+            os.close(self.fd)
+            self.fd=None
+            if self.Rotate>0:
+                self.RotateAt=now+self.Rotate
+
+            # Compressing a big log takes a while, don't hold up the next batch
+            if self.Compress:
+                threading.Thread(target=self.CompressLog,args=(old,)).start()
+            else:
+                self.PurgeRotated()
+
+    def CompressLog(self,fn):
+        try:
+            with open(fn,'rb') as src, gzip.open(fn+'.gz','wb') as dst:
+                shutil.copyfileobj(src,dst)
+            os.remove(fn)
+        except:
+            pass
+        self.PurgeRotated()
+
+    # Remove all but the Keep newest rotated logs
+
+    def PurgeRotated(self):
+        if self.Keep<=0:
+            return
+        dname=os.path.dirname(self.filename)
+        bname=os.path.basename(self.filename)+'.'
+        old=[]
+        for fn in os.listdir(dname):
+            if fn.startswith(bname) and fn[len(bname):len(bname)+1].isdigit():
+                old.append(fn)
+        old.sort()
+        for fn in old[:-self.Keep]:
+            try:
+                os.remove(dname+'/'+fn)
+            except:
+                pass
+
+    # After a fork the child starts clean. Whatever was pending belongs to the
+    # parent, which will write it.
+
+    def AfterFork(self):
+        self.lock=threading.Lock()
+        self.fileLock=threading.Lock()
+        self.pending=[]
+
+# Every log writer of this process, by file name
+
+LogWriters={}
+LogWritersLock=threading.Lock()
+LogFlusher=None
+
+def GetLogWriter(filename):
+    lw=LogWriters.get(filename)
+    if lw==None:
+        with LogWritersLock:
+            if filename not in LogWriters:
+                LogWriters[filename]=LogWriter(filename)
+            lw=LogWriters[filename]
+    return lw
+
+def FlushLogs():
+    for lw in list(LogWriters.values()):
+        lw.Flush()
+
+# One thread writes out every log of the process
+
+def LogFlusherLoop():
+    while True:
+        interval=1
+        for lw in list(LogWriters.values()):
+            if lw.FlushInterval>0:
+                interval=min(interval,lw.FlushInterval)
+        time.sleep(interval)
+        FlushLogs()
+
+def StartLogFlusher():
+    global LogFlusher
+
+    if LogFlusher==None:
+        with LogWritersLock:
+            if LogFlusher==None:
+                LogFlusher=threading.Thread(target=LogFlusherLoop,daemon=True)
+                LogFlusher.start()
+
+def LogWritersAfterFork():
+    global LogWritersLock
+    global LogFlusher
+
+    LogWritersLock=threading.Lock()
+    LogFlusher=None
+    for lw in LogWriters.values():
+        lw.AfterFork()
+
+os.register_at_fork(after_in_child=LogWritersAfterFork)
+atexit.register(FlushLogs)
+
 # Doubly lisked list with sentinel for bidirectional intertion
 #
 # Driver example
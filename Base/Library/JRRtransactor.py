@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Jackrabbit Relay transactor pool
+# 2021 Copyright © Robert APM Darin
+# All rights reserved unconditionally.
+
+# Every PlaceOrder started from scratch pays for importing ccxt, oandapyV20 and
+# requests before it ever looks at the order. Under a burst of alerts, that
+# startup is most of the latency.
+#
+# The pool keeps one JackrabbitTransactor per framework running with all of that
+# already imported. The Relay hands it the transactor and the payload over a
+# unix socket, the pool forks a warm copy of itself to run the PlaceOrder and the
+# output comes back on the same socket, exactly as communicate() returned it.
+#
+# Each order still gets its own process. The PlaceOrder programs exit, mangle
+# sys.argv and register atexit handlers, so they can NOT share an interpreter.
+
+# Request, one line per connection:
+# { "Transactor":"/home/JackrabbitRelay2/Base/PlaceOrder.kucoin.spot", "Payload":"{ ... }" }
+
+import sys
+sys.path.append('/home/JackrabbitRelay2/Base/Library')
+import os
+import time
+import socket
+import subprocess
+import asyncio
+import json
+
+BaseDirectory='/home/JackrabbitRelay2/Base'
+ConfigDirectory='/home/JackrabbitRelay2/Config'
+
+# The socket a framework pool listens on
+
+def SocketName(framework):
+    return f"{BaseDirectory}/Transactor.{framework}.sock"
+
+# The routing table for transactors, built from the PlaceOrder programs in the
+# base directory:
+#
+#    PlaceOrder.kucoin.spot    -> kucoin.spot
+#    PlaceOrder.oanda          -> oanda
+#
+# Rebuilt only when the directory changes, so finding the transactor for an
+# order never touches the disk.
+
+class TransactorRoutes:
+    def __init__(self,Directory=None):
+        if Directory==None:
+            self.Directory=BaseDirectory
+        else:
+            self.Directory=Directory
+        self.mtime=None
+        self.Routes={}
+        self.Reload()
+
+    # Read the directory again if it changed. Returns True if it was read.
+
+    def Reload(self):
+        try:
+            mtime=os.stat(self.Directory).st_mtime
+        except:
+            return False
+        if mtime==self.mtime:
+            return False
+
+        routes={}
+        for fn in os.listdir(self.Directory):
+            if fn.startswith('PlaceOrder.') and len(fn)>11:
+                path=self.Directory+'/'+fn
+                if os.path.isfile(path):
+                    routes[fn[11:]]=path
+
+        self.Routes=routes
+        self.mtime=mtime
+        return True
+
+    # Find the transactor for an exchange and market. If the market has no
+    # transactor of its own, the exchange transactor handles it. None if there
+    # is no transactor at all.
+
+    def Find(self,exchange,market=None):
+        if market!=None:
+            fn=self.Routes.get(exchange+'.'+market)
+            if fn!=None:
+                return fn
+        return self.Routes.get(exchange)
+
+# Find the framework of an exchange from its config file. The first account
+# decides. Cached until the config file changes.
+
+FrameworkCache={}
+
+def GetFramework(exchange):
+    fn=ConfigDirectory+'/'+exchange+'.cfg'
+    try:
+        mtime=os.stat(fn).st_mtime
+    except:
+        return None
+
+    if exchange in FrameworkCache and FrameworkCache[exchange][0]==mtime:
+        return FrameworkCache[exchange][1]
+
+    framework=None
+    cf=open(fn,'rt')
+    for line in cf.readlines():
+        line=line.strip()
+        if len(line)>0 and line[0]!='#':
+            try:
+                framework=json.loads(line)['Framework'].lower()
+            except:
+                pass
+            break
+    cf.close()
+
+    FrameworkCache[exchange]=[mtime,framework]
+    return framework
+
+# Hand the order to the warm pool of its framework. Returns None ONLY if the
+# pool could not be reached, so the caller can safely fall back. Once the
+# request is sent, whatever comes back is the answer. Never run an order twice.
+
+def PoolTalker(framework,transactor,payload,Stats=None):
+    try:
+        ts=socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        ts.connect(SocketName(framework))
+    except:
+        return None
+
+    res=[]
+    try:
+        req=json.dumps({ "Transactor":transactor, "Payload":payload })+'\n'
+        ts.sendall(req.encode())
+        ts.shutdown(socket.SHUT_WR)
+        while True:
+            buf=ts.recv(65536)
+            if not buf:
+                break
+            if len(res)==0:
+                FirstOutput(Stats,'pool')
+            res.append(buf)
+    except:
+        pass
+    ts.close()
+
+    return b''.join(res)
+
+# Spawn time is how long it took the transactor to say anything at all. Every
+# transactor logs its name and version as the first thing it does, so this is
+# the cost of getting it running, pool or not.
+
+def FirstOutput(Stats,via):
+    if Stats!=None:
+        Stats['Via']=via
+        Stats['Spawn']=time.time()-Stats['Start']
+
+# Run a transactor and return its output. Uses the warm pool when one is
+# running for the framework, otherwise starts the transactor the old way.
+#
+# If Stats is a dictionary, it gets how the transactor was run (Via) and its
+# spawn time in seconds (Spawn).
+
+def RunTransactor(transactor,payload,framework=None,Stats=None):
+    if Stats!=None:
+        Stats['Start']=time.time()
+
+    res=None
+    if framework!=None:
+        res=PoolTalker(framework,transactor,payload,Stats)
+
+    if res==None:
+        subp=subprocess.Popen([ transactor ],stdin=subprocess.PIPE,stdout=subprocess.PIPE,stderr=subprocess.DEVNULL)
+        try:
+            subp.stdin.write(payload.encode())
+            subp.stdin.close()
+        except BrokenPipeError:
+            pass
+        res=subp.stdout.read1(65536)
+        if len(res)>0:
+            FirstOutput(Stats,'process')
+        res+=subp.stdout.read()
+        subp.stdout.close()
+        subp.wait()
+
+    return res
+
+# The same for the asyncio ingress. The event loop is never blocked waiting on
+# a transactor.
+
+async def PoolTalkerAsync(framework,transactor,payload,Stats=None):
+    try:
+        reader,writer=await asyncio.open_unix_connection(SocketName(framework))
+    except:
+        return None
+
+    res=[]
+    try:
+        req=json.dumps({ "Transactor":transactor, "Payload":payload })+'\n'
+        writer.write(req.encode())
+        await writer.drain()
+        writer.write_eof()
+        while True:
+            buf=await reader.read(65536)
+            if not buf:
+                break
+            if len(res)==0:
+                FirstOutput(Stats,'pool')
+            res.append(buf)
+    except:
+        pass
+    writer.close()
+
+    return b''.join(res)
+
+async def RunTransactorAsync(transactor,payload,framework=None,Stats=None):
+    if Stats!=None:
+        Stats['Start']=time.time()
+
+    res=None
+    if framework!=None:
+        res=await PoolTalkerAsync(framework,transactor,payload,Stats)
+
+    if res==None:
+        subp=await asyncio.create_subprocess_exec(transactor,stdin=asyncio.subprocess.PIPE,stdout=asyncio.subprocess.PIPE,stderr=asyncio.subprocess.DEVNULL)
+        try:
+            subp.stdin.write(payload.encode())
+            await subp.stdin.drain()
+            subp.stdin.close()
+        except (BrokenPipeError,ConnectionResetError):
+            pass
+        res=await subp.stdout.read(65536)
+        if len(res)>0:
+            FirstOutput(Stats,'process')
+        res+=await subp.stdout.read()
+        await subp.wait()
+
+    return res
+
+# The pool processes belong to the Relay server that started them. If one dies,
+# Check brings it back, but not more often then the restart delay so a broken
+# framework doesn't turn into a fork storm.
+
+class TransactorPool:
+    def __init__(self,Frameworks=None,RestartDelay=10):
+        self.Frameworks=[]
+        if Frameworks!=None:
+            for framework in Frameworks:
+                self.Frameworks.append(framework.lower().strip())
+        self.RestartDelay=RestartDelay
+        self.Workers={}
+        self.Started={}
+
+    def StartWorker(self,framework):
+        self.Workers[framework]=subprocess.Popen([ BaseDirectory+'/JackrabbitTransactor',framework ], \
+            stdin=subprocess.DEVNULL,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+        self.Started[framework]=time.time()
+
+    def Start(self):
+        for framework in self.Frameworks:
+            self.StartWorker(framework)
+        return self.Frameworks
+
+    # Restart any pool that has died. Returns the frameworks restarted.
+
+    def Check(self):
+        restarted=[]
+        for framework in self.Workers:
+            if self.Workers[framework].poll()!=None \
+            and time.time()>self.Started[framework]+self.RestartDelay:
+                self.StartWorker(framework)
+                restarted.append(framework)
+        return restarted
+
+    def Stop(self):
+        for framework in self.Workers:
+            if self.Workers[framework].poll()==None:
+                self.Workers[framework].terminate()
+
+###
+### End of module
+###
@@ -22,7 +22,7 @@ import requests
 # Framework APIs
 
 import JRRsupport
-from JackrabbitRelay import JackrabbitLog
+from JackrabbitRelay import JackrabbitLog,GetResult
 
 # The proxy class for the system. This IS going to be a royal pain in the ass to
 # type, but it also prevent mistakes as the system grows and developes. This
@@ -115,6 +115,7 @@ class JackrabbitProxy:
         # if no command line, check for stabdard input, ie. process order
 
         if self.Payload!=None:
+            self.JRLog.EnableResult()
             self.ProcessPayload()
 
         # Setup the exchange and account passed in to the method. At this point, if we dont have an exchange
@@ -235,12 +236,12 @@ class JackrabbitProxy:
     # placing the order and return the results.
 
     def SendWebhook(self,Order):
-        headers={'content-type': 'text/plain', 'Connection': 'close'}
+        headers={'content-type': 'text/plain'}
 
         resp=None
         res=None
         try:
-            resp=requests.post(self.Active['Webhook'],headers=headers,data=json.dumps(Order))
+            resp=JRRsupport.PostWebhook(self.Active['Webhook'],json.dumps(Order),headers)
             try:
                 r=json.loads(resp.text)
                 try:
@@ -260,6 +261,12 @@ class JackrabbitProxy:
         if res==None:
             return None
 
+        envelope=GetResult(res)
+        if envelope!=None:
+            return envelope.get('ProxyResult')
+
+        # Proxies without the result envelope
+
         try:
             if res.find('ProxyResult: ')>-1:
                 s=res.find('ProxyResult:')+13
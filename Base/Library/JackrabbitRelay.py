@@ -9,8 +9,10 @@ import sys
 sys.path.append('/home/JackrabbitRelay2/Base/Library')
 import os
 import atexit
+import time
 import json
 import requests
+import urllib.parse
 from datetime import datetime
 
 # Framework APIs
@@ -19,6 +21,48 @@ import JRRccxt
 import JRRoanda
 import JRRmimic
 import JRRsupport
+import JRRtransactor
+
+# Longest an entry order waits for the strike and exit lanes of its exchange,
+# in seconds
+
+PriorityDefer=30
+
+# Read the result envelope from transactor output. With a list payload, the
+# Relay answers with every output in turn, this is the last one. None if there
+# is no envelope, as with a transactor that predates it.
+
+def GetResult(res):
+    if res==None:
+        return None
+
+    e=len(res)
+    while e>0 and res[e-1] in '\r\n':
+        e-=1
+    s=res.rfind('\n',0,e)+1
+    if not res.startswith(JRRsupport.ResultMarker,s):
+        return None
+    try:
+        result=json.loads(res[s+len(JRRsupport.ResultMarker):e])
+    except:
+        return None
+    if type(result) is not dict:
+        return None
+    return result
+
+# Transactors on this host, for orders routed internally. Built the first time
+# it is needed.
+
+InternalRoutes=None
+
+def GetInternalRoutes():
+    global InternalRoutes
+
+    if InternalRoutes==None:
+        InternalRoutes=JRRtransactor.TransactorRoutes()
+    else:
+        InternalRoutes.Reload()
+    return InternalRoutes
 
 # This is the logging class
 #
@@ -40,6 +84,7 @@ class JackrabbitLog:
             self.basename=os.path.basename(sys.argv[0])
         self.SetLogName(filename)
         self.RaiseError=RaiseError
+        self.Result=None
 
     def SetLogDirectory(self,dirname):
         if dirname!=None:
@@ -67,9 +112,7 @@ class JackrabbitLog:
         s=f'{time} {pid:7.0f} {text}\n'
 
         fn=self.LogDirectory+'/'+self.logfile+'.log'
-        fh=open(fn,'a+')
-        fh.write(s)
-        fh.close()
+        JRRsupport.GetLogWriter(fn).Write(s)
         if stdOut==True:
             print(s.rstrip())
             sys.stdout.flush()
@@ -81,6 +124,7 @@ class JackrabbitLog:
 
     def Error(self,f,s):
         msg=f+' failed with: '+s
+        self.SetResult(Status='Failed',Reason=s)
         self.Write(msg)
         self.Elapsed()
         if self.RaiseError==False:
@@ -90,10 +134,45 @@ class JackrabbitLog:
 
     def Success(self,f,s):
         msg=f+' successful with: '+s
+        self.SetResult(Status='Success')
         self.Write(msg)
         self.Elapsed()
         sys.exit(0)
 
+    # Orders placed on an exchange are confirmed with their ID, along with the
+    # fill details the exchange gave back, if any.
+
+    def Confirmation(self,id,**details):
+        self.SetResult(Status='Success',ID=id,**details)
+        self.Write("|- Order Confirmation ID: "+id)
+
+    # The result envelope. A program processing a payload ends its output with
+    # one line holding the outcome as JSON, so whoever ran it reads that line
+    # instead of searching the log text:
+    #
+    #   JRResult: {"Status":"Success","ID":"123","Reason":null,"Elapsed":0.734,...}
+    #
+    # Status is Success once an order is confirmed, Failed with the reason on
+    # an error and Done if neither happened. Written when the program exits,
+    # which is always after everything else it says.
+
+    def EnableResult(self):
+        if self.Result==None:
+            self.Result={ "Status":"Done", "ID":None, "Reason":None }
+            atexit.register(self.WriteResult)
+
+    def SetResult(self,**kwargs):
+        if self.Result!=None:
+            self.Result.update(kwargs)
+
+    def WriteResult(self):
+        self.Result['Elapsed']=(datetime.now()-self.StartTime).total_seconds()
+        try:
+            sys.stdout.write(JRRsupport.ResultLine(self.Result))
+            sys.stdout.flush()
+        except:
+            pass
+
 # The main class for the system. This IS going to be a royal pain in the ass to
 # type, but it also prevent mistakes as the system grows and developes. This
 # will also allow me to build in place as I replace one section at a time.
@@ -134,6 +213,8 @@ class JackrabbitRelay:
 
         # This is for the rate limiting sub-system
         self.Limiter=None
+        self.Priority=None
+        self.Deferred=False
 
         # Initialize The log to just the basename of the program.
         self.JRLog=JackrabbitLog(RaiseError=RaiseError)
@@ -220,6 +301,7 @@ class JackrabbitRelay:
         # if no command line, check for stabdard input, ie. process order
 
         if self.Payload!=None:
+            self.JRLog.EnableResult()
             self.ProcessPayload()
 
         # Process secondary config file. Exchange, Account, and Asset must be
@@ -378,6 +460,12 @@ class JackrabbitRelay:
         if res==None:
             return None
 
+        envelope=GetResult(res)
+        if envelope!=None:
+            return envelope.get('ID')
+
+        # Transactors without the result envelope
+
         result=None
         try:
             if res.find('Order Confirmation ID')>-1:
@@ -397,6 +485,12 @@ class JackrabbitRelay:
         if res==None:
             return None
 
+        envelope=GetResult(res)
+        if envelope!=None:
+            return envelope.get('Reason')
+
+        # Transactors without the result envelope
+
         srch='failed with:'
 
         result=None
@@ -416,12 +510,12 @@ class JackrabbitRelay:
     # placing the order and return the results.
 
     def SendWebhook(self,Order):
-        headers={'content-type': 'text/plain', 'Connection': 'close'}
+        headers={'content-type': 'text/plain'}
 
         resp=None
         res=None
         try:
-            resp=requests.post(self.Active['Webhook'],headers=headers,data=json.dumps(Order))
+            resp=JRRsupport.PostWebhook(self.Active['Webhook'],json.dumps(Order),headers)
             try:
                 r=json.loads(resp.text)
                 try:
@@ -435,6 +529,78 @@ class JackrabbitRelay:
 
         return res
 
+    # Internal order routing. A program on the same host as the Relay server
+    # doesn't need HTTP to place an order. The order goes straight to the
+    # transactor of its exchange, through the warm transactor pool if one is
+    # running, just as the Relay server would hand it over. There is no HTTP
+    # round trip and no IP list. The transactor still verifies the order,
+    # identity included. Admission limits and the duplicate cache belong to
+    # the Relay server and do not apply.
+    #
+    # The result is the transactor's result envelope, with its output added,
+    # instead of text to search:
+    #
+    #   { "Status":"Success", "ID":"<order id>", "Reason":None, "Elapsed":0.734, "Output":"<transactor output>" }
+    #
+    # Status is Success with an order ID, Failed with the reason, or Done if
+    # the transactor said neither, like a DSR passing the order on.
+    #
+    # Returns None if this host has no transactor for the order.
+
+    def SubmitOrder(self,Order):
+        try:
+            exchange=Order['Exchange'].split(',')[0].lower().strip()
+            market=None
+            if 'Market' in Order:
+                market=Order['Market'].lower().strip()
+        except:
+            return None
+
+        fn=GetInternalRoutes().Find(exchange,market)
+        if fn==None:
+            return None
+
+        framework=JRRtransactor.GetFramework(exchange)
+        res=JRRtransactor.RunTransactor(fn,json.dumps(Order),framework)
+        return self.OrderResult(res.decode(errors='replace'))
+
+    # Place an order through the Relay. If the webhook is this host, or there
+    # is no webhook, the order is routed internally. Otherwise, or if this host
+    # has no transactor for it, it is sent to the webhook. Either way the
+    # result is the same as SubmitOrder.
+
+    def SendOrder(self,Order):
+        res=None
+        if self.LocalWebhook():
+            res=self.SubmitOrder(Order)
+        if res==None:
+            res=self.OrderResult(self.SendWebhook(Order))
+        return res
+
+    def LocalWebhook(self):
+        if 'Webhook' not in self.Active:
+            return True
+        try:
+            host=urllib.parse.urlparse(self.Active['Webhook']).hostname
+        except:
+            return False
+        return host in [ '127.0.0.1','localhost','::1' ]
+
+    def OrderResult(self,res):
+        envelope=GetResult(res)
+        if envelope!=None:
+            return { **envelope, "Output":res }
+
+        result={ "Status":"Done", "ID":None, "Reason":None, "Output":res }
+        result['ID']=self.GetOrderID(res)
+        if result['ID']!=None:
+            result['Status']='Success'
+        else:
+            result['Reason']=self.GetFailedReason(res)
+            if result['Reason']!=None:
+                result['Status']='Failed'
+        return result
+
     # Remap TradingView symbol to the exchange symbol/broker
 
     def TradingViewRemap(self):
@@ -484,6 +650,7 @@ class JackrabbitRelay:
 
         try:
             self.Order=json.loads(self.Payload,strict=False)
+            self.Deferred=False
         except json.decoder.JSONDecodeError as err:
             self.JRLog.Error('Processing Payload','Payload damaged')
 
@@ -655,19 +822,79 @@ class JackrabbitRelay:
     # This if where things get messy. The basic API must have calls to
     # each framework buy uniform to the Relay core.
 
-    # Rotate API key/Secret
+    # Rotate API key/Secret. EnforceRateLimit may switch again, to the key with
+    # the most of its budget left.
 
     def RotateKeys(self):
         if self.CurrentKey<0:
-            self.CurrentKey=(os.getpid()%len(self.Keys))
+            self.UseKey(os.getpid()%len(self.Keys))
         else:
-            self.CurrentKey=((self.CurrentKey+1)%len(self.Keys))
+            self.UseKey((self.CurrentKey+1)%len(self.Keys))
+
+    def UseKey(self,n):
+        self.CurrentKey=n
         self.Active=self.Keys[self.CurrentKey]
 
         if self.Framework=='ccxt':
+            self.Broker.Active=self.Active
             self.ccxt=self.Broker.SetExchangeAPI()
 
-    # Carry out rate limit
+    # Each API key has its own rate budget in the Locker, a token bucket
+    # refilled every RateLimit ms of that key and holding its RateBurst calls,
+    # 1 unless the configuration says otherwise. The key's index in the
+    # configuration names it.
+    #
+    # Only ccxt switches keys per call. Every other framework stays with the key
+    # it logged in with, so that is the only budget it takes from.
+
+    def KeyBudget(self,n):
+        key=self.Keys[n]
+        if 'RateLimit' in key:
+            ratelimit=int(key['RateLimit'])
+        else:
+            ratelimit=1000
+        if 'RateBurst' in key:
+            burst=max(1,int(key['RateBurst']))
+        else:
+            burst=1
+        return { "Key":f"RateLimiter.{self.Exchange}.{self.Account}.{n}", "Interval":ratelimit/1000, "Burst":burst }
+
+    # Take a token for the next call, from the least used key that has one.
+    # 0 once it is taken, otherwise the seconds until one of them will have
+    # one. None if the Locker doesn't keep budgets.
+
+    def TakeKeyBudget(self):
+        if self.Framework=='ccxt':
+            keys=range(len(self.Keys))
+        else:
+            keys=[ max(0,self.CurrentKey) ]
+        budgets=[ self.KeyBudget(n) for n in keys ]
+
+        res=self.Limiter.AcquireAny(budgets)
+        if res==None:
+            return None
+        wait,key=res
+        if key!=None:
+            n=keys[[ b['Key'] for b in budgets ].index(key)]
+            if n!=self.CurrentKey:
+                self.UseKey(n)
+        return wait
+
+    # Carry out rate limit, before each call to the exchange
+    #
+    # Every process on the exchange takes its calls from the budgets of the
+    # account's keys. A call only waits when every key has had all it allows,
+    # so each key added adds its own rate. A Locker without budgets has every
+    # call hold the exchange's lock for RateLimit ms instead.
+    #
+    # Orders in the strike and exit lanes announce themselves to the rest of
+    # the exchange for a few seconds at a time. New entries, buys and longs,
+    # wait up to PriorityDefer seconds while any are announced, once per order
+    # at its first call. The announcement holds the time it runs out, as the
+    # Locker doesn't say. It is shared by every such order on the exchange, so
+    # it is never erased, only left to run out after the last one's last call.
+    # Calls made for anything but an order, such as OliverTwist's, take no
+    # part in either.
 
     def EnforceRateLimit(self):
         if 'RateLimit' in self.Active:
@@ -675,11 +902,41 @@ class JackrabbitRelay:
         else:
             ratelimit=1000
 
+        if type(self.Order) is dict:
+            lane=JRRsupport.OrderLane(self.Order)
+            if lane!='entry':
+                hold=(ratelimit/1000)*2+5
+                self.Priority.Put(hold,str(time.time()+hold))
+            elif not self.Deferred and str(self.Order.get('Action','')).lower().strip() in [ 'buy','long' ]:
+                self.Deferred=True
+                defer=time.time()+PriorityDefer
+                while time.time()<defer and self.PriorityWaiting():
+                    JRRsupport.ElasticSleep(ratelimit/1000)
+
+        while True:
+            wait=self.TakeKeyBudget()
+            if wait==None:
+                break
+            if wait<=0:
+                return
+            time.sleep(wait)
+
         while self.Limiter.Lock()!='locked':
             JRRsupport.ElasticSleep(ratelimit/1000)
         JRRsupport.ElasticSleep(ratelimit/1000)
         self.Limiter.Unlock()
 
+    # Is an order of a more urgent lane at work on this exchange?
+
+    def PriorityWaiting(self):
+        try:
+            resp=json.loads(self.Priority.Get())
+            if resp['Status']=='Done' and float(resp['DataStore'])>time.time():
+                return True
+        except:
+            pass
+        return False
+
     # Function to run at exit.
 
     def CleanUp(self):
@@ -705,6 +962,7 @@ class JackrabbitRelay:
         # Initialize rate limiting sub-system
         ln="RateLimiter."+self.Exchange
         self.Limiter=JRRsupport.Locker(ln,ID=ln)
+        self.Priority=JRRsupport.Locker(ln+'.Priority',ID=ln+'.Priority')
         atexit.register(self.CleanUp)
 
         # Market data is loaded automatically. Pull it into the Relay object as
@@ -727,64 +985,64 @@ class JackrabbitRelay:
 
     def GetMarkets(self):
         self.RotateKeys()
-        self.Markets=self.Broker.GetMarkets()
         self.EnforceRateLimit()
+        self.Markets=self.Broker.GetMarkets()
         return self.Markets
 
     # Get account balance(s)
 
     def GetBalance(self,**kwargs):
         self.RotateKeys()
-        self.Results=self.Broker.GetBalance(**kwargs)
         self.EnforceRateLimit()
+        self.Results=self.Broker.GetBalance(**kwargs)
         return self.Results
 
     # Get the exchange positions. For and non-spot market
 
     def GetPositions(self,**kwargs):
         self.RotateKeys()
-        self.Results=self.Broker.GetPositions(**kwargs)
         self.EnforceRateLimit()
+        self.Results=self.Broker.GetPositions(**kwargs)
         return self.Results
 
     # Get OHLCV data from exchange
 
     def GetOHLCV(self,**kwargs):
         self.RotateKeys()
-        self.Results=self.Broker.GetOHLCV(**kwargs)
         self.EnforceRateLimit()
+        self.Results=self.Broker.GetOHLCV(**kwargs)
         return self.Results
 
     # Get ticker data from exchange
 
     def GetTicker(self,**kwargs):
         self.RotateKeys()
-        self.Results=self.Broker.GetTicker(**kwargs)
         self.EnforceRateLimit()
+        self.Results=self.Broker.GetTicker(**kwargs)
         return self.Results
 
     # Get orderbook data from exchange
 
     def GetOrderBook(self,**kwargs):
         self.RotateKeys()
-        self.Results=self.Broker.GetOrderBook(**kwargs)
         self.EnforceRateLimit()
+        self.Results=self.Broker.GetOrderBook(**kwargs)
         return self.Results
 
     # Get open orders
 
     def GetOpenOrders(self,**kwargs):
         self.RotateKeys()
-        self.Results=self.Broker.GetOpenOrders(**kwargs)
         self.EnforceRateLimit()
+        self.Results=self.Broker.GetOpenOrders(**kwargs)
         return self.Results
 
     # Get open Trades
 
     def GetOpenTrades(self,**kwargs):
         self.RotateKeys()
-        self.Results=self.Broker.GetOpenTrades(**kwargs)
         self.EnforceRateLimit()
+        self.Results=self.Broker.GetOpenTrades(**kwargs)
         return self.Results
 
     # Place Order to exchange. Needs to handle buy, sell, close
@@ -800,41 +1058,41 @@ class JackrabbitRelay:
 
     def PlaceOrder(self,**kwargs):
         self.RotateKeys()
-        self.Results=self.Broker.PlaceOrder(**kwargs)
         self.EnforceRateLimit()
+        self.Results=self.Broker.PlaceOrder(**kwargs)
         return self.Results
 
     def GetMinimum(self,**kwargs):
         self.RotateKeys()
-        minimum,mincost=self.Broker.GetMinimum(**kwargs)
         self.EnforceRateLimit()
+        minimum,mincost=self.Broker.GetMinimum(**kwargs)
         return minimum,mincost
 
     # Get the exact details of a specific order
 
     def GetOrderDetails(self,**kwargs):
         self.RotateKeys()
-        self.Results=self.Broker.GetOrderDetails(**kwargs)
         self.EnforceRateLimit()
+        self.Results=self.Broker.GetOrderDetails(**kwargs)
         return self.Results
 
     # Process the orphan order
 
     def MakeOrphanOrder(self,id,Order):
-        self.Results=self.Broker.MakeOrphanOrder(id,Order)
         self.EnforceRateLimit()
+        self.Results=self.Broker.MakeOrphanOrder(id,Order)
 
     # Process the conditional order
 
     def MakeConditionalOrder(self,id,Order):
-        self.Results=self.Broker.MakeConditionalOrder(id,Order)
         self.EnforceRateLimit()
+        self.Results=self.Broker.MakeConditionalOrder(id,Order)
 
     # Make ledger entry
 
     def WriteLedger(self,**kwargs):
-        self.Results=self.Broker.WriteLedger(**kwargs,LedgerDirectory=self.Directories['Ledger'])
         self.EnforceRateLimit()
+        self.Results=self.Broker.WriteLedger(**kwargs,LedgerDirectory=self.Directories['Ledger'])
 
     # Read ledger entry and locate by ID
 
@@ -241,8 +241,9 @@ def ProcessOrder(relay,Order,cid,amount,price,strikePrice,ds):
 
 #        print("PO B")
         # Feed the new order to Relay
-        result=relay.SendWebhook(newOrder)
-        oid=relay.GetOrderID(result)
+        sent=relay.SendOrder(newOrder)
+        result=sent['Output']
+        oid=sent['ID']
         if oid!=None:
             resp=relay.GetOrderDetails(id=oid,symbol=Order['Asset'])
             # Order must be closed as it succedded
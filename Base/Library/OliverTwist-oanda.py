@@ -269,8 +269,9 @@ def ReduceLotSize(relay,oldestTrade=None,val=1):
 
 #        relay.JRLog.Write("RLS D")
         # Feed the new order to Relay
-        result=relay.SendWebhook(newOrder)
-        oid=relay.GetOrderID(result)
+        sent=relay.SendOrder(newOrder)
+        result=sent['Output']
+        oid=sent['ID']
 #        relay.JRLog.Write(f"RLS E: {result}")
         if oid!=None:
             orderDetail=relay.GetOrderDetails(OrderID=oid)
@@ -323,8 +324,9 @@ def ProcessOrder(relay,Order,cid,units,price,strikePrice,ds,lowestOrder=None):
         newOrder['Identity']=relay.Active['Identity']
 
         # Feed the new order to Relay
-        result=relay.SendWebhook(newOrder)
-        oid=relay.GetOrderID(result)
+        sent=relay.SendOrder(newOrder)
+        result=sent['Output']
+        oid=sent['ID']
         if oid!=None:
             orderDetail=relay.GetOrderDetails(OrderID=oid)
 